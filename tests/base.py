@@ -19,9 +19,14 @@ along with this program; if not, write to the Free Software
 Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
 """
 
+import atexit
 import logging
+import os
+import shutil
+import tempfile
 from mock import patch, MagicMock
 from virtwho.config import VirtConfigSection, ValidationState
+from virtwho.manager.subscriptionmanager import SubscriptionManager
 
 # hack to use unittest2 on python <= 2.6, unittest otherwise
 # based on python version
@@ -31,6 +36,11 @@ if sys.version_info[0] > 2 or sys.version_info[1] > 6:
 else:
     import unittest2 as unittest
 
+# Tests must not read or write consumer UUID cached by virt-who on this system
+_uuid_dir = tempfile.mkdtemp()
+atexit.register(shutil.rmtree, _uuid_dir, True)
+SubscriptionManager.CONSUMER_UUID_FILE = os.path.join(_uuid_dir, 'consumer_uuid')
+
 
 class TestBase(unittest.TestCase):
     @classmethod
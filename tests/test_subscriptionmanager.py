@@ -1,16 +1,23 @@
 from __future__ import print_function
 import os
 import sys
+import json
 import shutil
+import socket
+import ssl
 import tempfile
+import threading
+from operator import itemgetter
 
 from mock import patch, Mock, DEFAULT, MagicMock, ANY
+from six.moves.http_client import BadStatusLine
+from rhsm.connection import RestlibException
 
 from base import TestBase, unittest
 
 from virtwho.config import VirtConfigSection, DestinationToSourceMapper, VW_ENV_CLI_SECTION_NAME,\
     init_config
-from virtwho.manager import Manager
+from virtwho.manager import Manager, ManagerError
 from virtwho.manager.subscriptionmanager import SubscriptionManager
 from virtwho.virt import Guest, Hypervisor, HostGuestAssociationReport, DomainListReport, AbstractVirtReport
 from virtwho.parser import parse_options
@@ -58,13 +65,16 @@ class TestSubscriptionManager(TestBase):
         shutil.rmtree(cls.tempdir)
         cls.uep_connection.stop()
 
+    def setUp(self):
+        SubscriptionManager.clear_cache()
+
     def test_sendVirtGuests(self):
         config = VirtConfigSection.from_dict({'type': 'libvirt'}, 'test', None)
         report = DomainListReport(config, self.guestList, self.hypervisor_id)
         self.sm.sendVirtGuests(report)
         self.sm.connection.updateConsumer.assert_called_with(
             123,
-            guest_uuids=[g.toDict() for g in self.guestList],
+            guest_uuids=sorted([g.toDict() for g in self.guestList], key=itemgetter('guestId')),
             hypervisor_id=self.hypervisor_id)
 
     def test_hypervisorCheckIn(self):
@@ -81,8 +91,8 @@ class TestSubscriptionManager(TestBase):
             env,
             dict((host.hypervisorId, [g.toDict() for g in host.guestIds]) for host in self.mapping['hypervisors']),
             options=None)
-        self.sm.logger.warning.assert_called_with("The hypervisor id '123' is assigned to 2 different systems. "
-                        "Only one will be recorded at the server.")
+        self.sm.logger.warning.assert_called_with("The hypervisor id '%s' is assigned to 2 different systems. "
+                        "Only one will be recorded at the server.", '123')
 
     @patch('rhsm.connection.UEPConnection')
     # def test_hypervisorCheckInAsync(self):
@@ -102,10 +112,238 @@ class TestSubscriptionManager(TestBase):
             expected,
             options=None
         )
-        self.sm.logger.warning.assert_called_with("The hypervisor id '123' is assigned to 2 different systems. "
-                        "Only one will be recorded at the server.")
+        self.sm.logger.warning.assert_called_with("The hypervisor id '%s' is assigned to 2 different systems. "
+                        "Only one will be recorded at the server.", '123')
         self.sm.connection.return_value.has_capability = MagicMock(return_value=False)
 
+    @patch('rhsm.connection.UEPConnection')
+    def test_connection_reused(self, rhsmconnection):
+        self.sm._connect()
+        self.sm._connect()
+        self.assertEqual(rhsmconnection.call_count, 1)
+        self.assertEqual(rhsmconnection.return_value.ping.call_count, 1)
+
+    @patch('rhsm.connection.UEPConnection')
+    def test_connection_cache_cleared(self, rhsmconnection):
+        self.sm._connect()
+        Manager.clear_cache()
+        self.sm._connect()
+        self.assertEqual(rhsmconnection.call_count, 2)
+
+    @patch('rhsm.config.initConfig')
+    @patch('rhsm.connection.UEPConnection')
+    def test_connection_released_after_connect(self, rhsmconnection, rhsmconfig):
+        rhsmconfig.return_value.get.side_effect = lambda group, key: {'consumerCertDir': self.tempdir}.get(key, DEFAULT)
+        sm1 = SubscriptionManager(self.logger, Mock())
+        sm2 = SubscriptionManager(self.logger, Mock())
+        sm1._connect()
+        thread = threading.Thread(target=sm2.prepare)
+        thread.start()
+        thread.join(5)
+        self.assertFalse(thread.is_alive())
+
+    @patch('rhsm.config.initConfig')
+    @patch('rhsm.connection.UEPConnection')
+    def test_connection_shared_between_instances(self, rhsmconnection, rhsmconfig):
+        rhsmconfig.return_value.get.side_effect = lambda group, key: {'consumerCertDir': self.tempdir}.get(key, DEFAULT)
+        sm1 = SubscriptionManager(self.logger, Mock())
+        sm2 = SubscriptionManager(self.logger, Mock())
+        self.assertIs(sm1._connect(), sm2._connect())
+        self.assertEqual(rhsmconnection.call_count, 1)
+
+    @patch('os.access')
+    def test_cert_access_checked_once(self, access):
+        access.return_value = True
+        self.addCleanup(setattr, self.sm, '_cert_readable', None)
+        self.sm._cert_readable = None
+        self.sm._connect()
+        self.sm._connect()
+        self.assertEqual(access.call_count, 1)
+
+    @patch('rhsm.connection.UEPConnection')
+    def test_connection_invalidated_on_socket_error(self, rhsmconnection):
+        config = VirtConfigSection.from_dict({'type': 'libvirt'}, 'test', None)
+        report = DomainListReport(config, self.guestList, self.hypervisor_id)
+        rhsmconnection.return_value.updateConsumer.side_effect = socket.error('Connection reset by peer')
+        self.assertRaises(ManagerError, self.sm.sendVirtGuests, report)
+        self.sm._connect()
+        self.assertEqual(rhsmconnection.call_count, 2)
+
+    @patch('rhsm.connection.UEPConnection')
+    def test_connection_invalidated_on_owner_check_error(self, rhsmconnection):
+        config = VirtConfigSection.from_dict({'type': 'libvirt', 'owner': 'owner', 'env': 'env'}, 'test', None)
+        report = HostGuestAssociationReport(config, self.mapping)
+        report.job_id = 'job'
+        rhsmconnection.return_value.getConsumer.side_effect = socket.error('Connection reset by peer')
+        self.assertRaises(ManagerError, self.sm.check_report_state, report)
+        rhsmconnection.return_value.getConsumer.side_effect = None
+        rhsmconnection.return_value.getConsumer.return_value = {}
+        self.sm._connect(config)
+        self.assertEqual(rhsmconnection.call_count, 2)
+
+    @patch('rhsm.connection.UEPConnection')
+    def test_connection_kept_on_server_error(self, rhsmconnection):
+        # The server answered, so the connection itself works
+        config = VirtConfigSection.from_dict({'type': 'libvirt', 'owner': 'owner', 'env': 'env'}, 'test', None)
+        report = HostGuestAssociationReport(config, self.mapping)
+        report.job_id = 'job'
+        rhsmconnection.return_value.getJob.side_effect = RestlibException(500, 'Internal Server Error')
+        self.assertRaises(ManagerError, self.sm.check_report_state, report)
+        self.sm._connect(config)
+        self.assertEqual(rhsmconnection.call_count, 1)
+
+    @patch('rhsm.connection.UEPConnection')
+    def test_ping_after_failed_request(self, rhsmconnection):
+        # Cached connection is not pinged, the one created after a failed
+        # request is
+        config = VirtConfigSection.from_dict({'type': 'libvirt', 'owner': 'owner', 'env': 'env'}, 'test', None)
+        report = HostGuestAssociationReport(config, self.mapping)
+        report.job_id = 'job'
+        rhsmconnection.return_value.getJob.side_effect = ssl.SSLError('EOF occurred in violation of protocol')
+        self.assertRaises(ManagerError, self.sm.check_report_state, report)
+        self.assertEqual(rhsmconnection.return_value.ping.call_count, 1)
+        self.assertRaises(ManagerError, self.sm.check_report_state, report)
+        self.assertEqual(rhsmconnection.return_value.ping.call_count, 2)
+        rhsmconnection.return_value.getJob.side_effect = None
+        rhsmconnection.return_value.getJob.return_value = {'state': 'RUNNING'}
+        self.sm.check_report_state(report)
+        self.sm.check_report_state(report)
+        self.assertEqual(rhsmconnection.return_value.ping.call_count, 3)
+
+    @patch('rhsm.connection.UEPConnection')
+    def test_capability_checked_once(self, rhsmconnection):
+        rhsmconnection.return_value.has_capability.return_value = True
+        config = VirtConfigSection.from_dict({'type': 'libvirt', 'owner': 'owner', 'env': 'env'}, 'test', None)
+        self.sm.hypervisorCheckIn(HostGuestAssociationReport(config, self.mapping))
+        self.sm.hypervisorCheckIn(HostGuestAssociationReport(config, self.mapping))
+        self.assertEqual(rhsmconnection.return_value.has_capability.call_count, 1)
+
+    @patch('rhsm.connection.UEPConnection')
+    def test_connection_invalidated_on_error(self, rhsmconnection):
+        config = VirtConfigSection.from_dict({'type': 'libvirt', 'owner': 'owner', 'env': 'env'}, 'test', None)
+        report = HostGuestAssociationReport(config, self.mapping)
+        rhsmconnection.return_value.hypervisorCheckIn.side_effect = BadStatusLine('')
+        self.assertRaises(ManagerError, self.sm.hypervisorCheckIn, report)
+        self.sm._connect(config)
+        self.assertEqual(rhsmconnection.call_count, 2)
+
+    @patch('rhsm.config.initConfig')
+    @patch('rhsm.certificate.create_from_file')
+    def test_uuid_cached_on_disk(self, create_from_file, rhsmconfig):
+        rhsmconfig.return_value.get.side_effect = lambda group, key: {'consumerCertDir': self.tempdir}.get(key, DEFAULT)
+        create_from_file.return_value.subject = {'CN': 'consumer-uuid'}
+        uuid_file = os.path.join(self.tempdir, 'saved_consumer_uuid')
+        self.addCleanup(os.remove, uuid_file)
+        with patch.object(SubscriptionManager, 'CONSUMER_UUID_FILE', uuid_file):
+            self.assertEqual(SubscriptionManager(self.logger, Mock()).uuid(), 'consumer-uuid')
+            # Next start of virt-who should not parse the certificate again
+            self.assertEqual(SubscriptionManager(self.logger, Mock()).uuid(), 'consumer-uuid')
+        self.assertEqual(create_from_file.call_count, 1)
+
+    @patch('rhsm.config.initConfig')
+    @patch('rhsm.certificate.create_from_file')
+    def test_uuid_loaded_on_init(self, create_from_file, rhsmconfig):
+        rhsmconfig.return_value.get.side_effect = lambda group, key: {'consumerCertDir': self.tempdir}.get(key, DEFAULT)
+        cert_file = os.path.join(self.tempdir, 'cert.pem')
+        uuid_file = os.path.join(self.tempdir, 'consumer_uuid')
+        with open(uuid_file, 'w') as f:
+            cert_stat = os.stat(cert_file)
+            json.dump({'cert_file': cert_file, 'cert_stat': [cert_stat.st_mtime, cert_stat.st_size, cert_stat.st_ino],
+                       'uuid': 'cached-uuid'}, f)
+        with patch.object(SubscriptionManager, 'CONSUMER_UUID_FILE', uuid_file):
+            sm = SubscriptionManager(self.logger, Mock())
+        self.assertEqual(sm.uuid(), 'cached-uuid')
+        self.assertFalse(create_from_file.called)
+
+    def _start_job_checks(self, configs):
+        """
+        Check status of one job per config, each in its own thread with its
+        own manager like destinations do. Return the started threads.
+        """
+        threads = []
+        for i, config in enumerate(configs):
+            sm = SubscriptionManager(self.logger, Mock())
+            sm.cert_uuid = 123
+            report = HostGuestAssociationReport(config, self.mapping)
+            report.job_id = 'job%d' % i
+            threads.append(threading.Thread(target=sm.check_report_state, args=(report,)))
+        for thread in threads:
+            thread.start()
+        return threads
+
+    @patch('rhsm.config.initConfig')
+    @patch('rhsm.connection.UEPConnection')
+    def test_job_status_checks_serialized(self, rhsmconnection, rhsmconfig):
+        # Destinations sharing the connection must not use it at the same time
+        rhsmconfig.return_value.get.side_effect = lambda group, key: {'consumerCertDir': self.tempdir}.get(key, DEFAULT)
+        config = VirtConfigSection.from_dict({'type': 'libvirt', 'owner': 'owner', 'env': 'env'}, 'test', None)
+        in_flight = []
+        max_in_flight = []
+        entered = threading.Event()
+        release = threading.Event()
+
+        def get_job(job_id):
+            in_flight.append(job_id)
+            max_in_flight.append(len(in_flight))
+            entered.set()
+            release.wait(10)
+            in_flight.remove(job_id)
+            return {'state': 'RUNNING'}
+
+        rhsmconnection.return_value.getJob.side_effect = get_job
+        threads = self._start_job_checks([config, config])
+        entered.wait(10)
+        # The other destination has to wait until this request finishes
+        cached, = SubscriptionManager._conn_cache.values()
+        self.assertFalse(cached.lock.acquire(False))
+        release.set()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(max_in_flight, [1, 1])
+
+    @patch('rhsm.config.initConfig')
+    @patch('rhsm.connection.UEPConnection')
+    def test_job_status_checks_parallel(self, rhsmconnection, rhsmconfig):
+        # Destinations using different connections don't wait for each other
+        rhsmconfig.return_value.get.side_effect = lambda group, key: {'consumerCertDir': self.tempdir}.get(key, DEFAULT)
+        configs = [
+            VirtConfigSection.from_dict({'type': 'libvirt', 'owner': 'owner', 'env': 'env',
+                                         'rhsm_hostname': hostname}, 'test', None)
+            for hostname in ('server1', 'server2')
+        ]
+        arrived = {'job0': threading.Event(), 'job1': threading.Event()}
+        overlapped = []
+
+        def get_job(job_id):
+            arrived[job_id].set()
+            # Each request waits for the other one, this only finishes
+            # when both run at the same time
+            other = 'job1' if job_id == 'job0' else 'job0'
+            overlapped.append(arrived[other].wait(10))
+            return {'state': 'RUNNING'}
+
+        rhsmconnection.return_value.getJob.side_effect = get_job
+        for thread in self._start_job_checks(configs):
+            thread.join()
+        self.assertEqual(overlapped, [True, True])
+        self.assertEqual(rhsmconnection.call_count, 2)
+
+    def test_uuid_cache_other_certificate(self):
+        # Certificate replaced without changing its mtime
+        uuid_file = os.path.join(self.tempdir, 'consumer_uuid')
+        mtime, size, ino = self.sm._cert_stat()
+        with open(uuid_file, 'w') as f:
+            json.dump({'cert_file': self.sm.cert_file, 'cert_stat': [mtime, size + 1, ino], 'uuid': 'old-uuid'}, f)
+        with patch.object(self.sm, 'CONSUMER_UUID_FILE', uuid_file):
+            self.assertIsNone(self.sm._load_uuid(self.sm._cert_stat()))
+
+    def test_uuid_cache_not_dict(self):
+        uuid_file = os.path.join(self.tempdir, 'consumer_uuid')
+        with open(uuid_file, 'w') as f:
+            json.dump([], f)
+        with patch.object(self.sm, 'CONSUMER_UUID_FILE', uuid_file):
+            self.assertIsNone(self.sm._load_uuid(self.sm._cert_stat()))
+
     @patch('rhsm.connection.UEPConnection')
     def test_job_status(self, rhsmconnection):
         rhsmconnection.return_value.has_capability.return_value = True
@@ -168,6 +406,7 @@ class TestSubscriptionManagerConfig(TestBase):
         cls.sm.cert_uuid = 123
 
     def setUp(self):
+        SubscriptionManager.clear_cache()
         self.config_dir = tempfile.mkdtemp()
         self.addCleanup(shutil.rmtree, self.config_dir)
         conf_dir_patch = patch('virtwho.config.VW_CONF_DIR', self.config_dir)
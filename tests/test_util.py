@@ -3,7 +3,7 @@ from mock import patch, MagicMock, PropertyMock
 
 from base import TestBase
 
-from virtwho.util import RequestsXmlrpcTransport
+from virtwho.util import RequestsXmlrpcTransport, LazyJson
 
 
 class FakeParser(object):
@@ -27,3 +27,13 @@ class TestRequestsXmlrpcTransport(TestBase):
         transport.parse_response(resp)
 
         assert p.called, 'Response.content should be used instead'
+
+
+class TestLazyJson(TestBase):
+    @patch('json.dumps')
+    def test_not_serialized_when_not_logged(self, dumps):
+        self.logger.debug("Data: %s", LazyJson({'a': 1}))
+        self.assertFalse(dumps.called)
+
+    def test_serialized_on_str(self):
+        self.assertEqual(str(LazyJson({'a': [1, 2]})), '{"a": [1, 2]}')
@@ -10,7 +10,7 @@ from stubs import StubEffectiveConfig
 from mock import Mock, patch, call
 from threading import Event
 
-from virtwho import MinimumJobPollInterval
+from virtwho import MinimumJobPollInterval, MaximumJobPollInterval
 from virtwho.config import DestinationToSourceMapper, VW_GLOBAL, EffectiveConfig, parse_file, \
     VirtConfigSection
 from virtwho.manager import ManagerThrottleError
@@ -103,6 +103,19 @@ env=env
         }
 
 
+class TestGuest(TestBase):
+    def test_to_dict_reused(self):
+        guest = Guest('GUUID1', xvirt.CONFIG_TYPE, Guest.STATE_RUNNING)
+        self.assertIs(guest.toDict(), guest.toDict())
+
+    def test_to_dict_updated_on_change(self):
+        guest = Guest('GUUID1', xvirt.CONFIG_TYPE, Guest.STATE_RUNNING)
+        self.assertEqual(guest.toDict()['attributes']['active'], 1)
+        guest.state = Guest.STATE_SHUTOFF
+        self.assertEqual(guest.toDict()['state'], Guest.STATE_SHUTOFF)
+        self.assertEqual(guest.toDict()['attributes']['active'], 0)
+
+
 class TestDestinationThread(TestBase):
 
     default_config_args = {
@@ -383,6 +396,81 @@ class TestDestinationThread(TestBase):
         self.assertEqual(2, len(reports))
 
 
+    def test_job_status_poll_backoff(self):
+        # Waits between polls for the job state grow exponentially up to
+        # MaximumJobPollInterval
+        batch_report = Mock()
+        batch_report.state = AbstractVirtReport.STATE_CREATED
+        manager = Mock()
+        items = [AbstractVirtReport.STATE_CREATED] * 5 + [AbstractVirtReport.STATE_FINISHED]
+        manager.check_report_state = Mock(side_effect=self.check_report_state_closure(items))
+        config, d = self.create_fake_config('test', **self.default_config_args)
+        destination_thread = DestinationThread(Mock(), config,
+                                               source_keys=['source1'],
+                                               source={},
+                                               dest=manager,
+                                               interval=10,
+                                               terminate_event=Mock(),
+                                               oneshot=False, options=self.options)
+        destination_thread.wait = Mock()
+        destination_thread.is_terminated = Mock(return_value=False)
+        destination_thread.check_report_status(batch_report)
+        destination_thread.wait.assert_has_calls([
+            call(wait_time=MinimumJobPollInterval),
+            call(wait_time=MinimumJobPollInterval * 2),
+            call(wait_time=MinimumJobPollInterval * 4),
+            call(wait_time=MinimumJobPollInterval * 8),
+            call(wait_time=MinimumJobPollInterval * 16),
+            call(wait_time=MaximumJobPollInterval)])
+
+    def test_job_status_checked_once_per_batch(self):
+        # Sources sent in one batch report share one job, its state should
+        # be checked only once
+        config1, d1 = self.create_fake_config('source1', **self.default_config_args)
+        config2, d2 = self.create_fake_config('source2', **self.default_config_args)
+        report1 = HostGuestAssociationReport(config1, {'hypervisors': []})
+        report2 = HostGuestAssociationReport(config2, {'hypervisors': []})
+        batch_report = Mock()
+        batch_report.state = AbstractVirtReport.STATE_CREATED
+        source_keys = ['source1', 'source2']
+        datastore = {'source1': report1, 'source2': report2}
+        manager = Mock()
+        items = [AbstractVirtReport.STATE_PROCESSING, AbstractVirtReport.STATE_PROCESSING]
+        manager.check_report_state = Mock(side_effect=self.check_report_state_closure(items))
+        config, d = self.create_fake_config('test', **self.default_config_args)
+        destination_thread = DestinationThread(Mock(), config,
+                                               source_keys=source_keys,
+                                               source=datastore,
+                                               dest=manager,
+                                               interval=10,
+                                               terminate_event=Mock(),
+                                               oneshot=False, options=self.options)
+        destination_thread.wait = Mock()
+        destination_thread.is_terminated = Mock(return_value=False)
+        destination_thread.submitted_report_and_hash_for_source = {
+            'source1': (batch_report, 'hash1'),
+            'source2': (batch_report, 'hash2'),
+        }
+        reports = destination_thread._get_data_common(source_keys)
+        self.assertEqual(0, len(reports))
+        self.assertEqual(manager.check_report_state.call_count, 1)
+
+    def test_prepare_connects_to_destination(self):
+        config, d = self.create_fake_config('test', **self.default_config_args)
+        manager = Mock()
+        destination_thread = DestinationThread(Mock(), config,
+                                               source_keys=['source1'],
+                                               source={},
+                                               dest=manager,
+                                               interval=10,
+                                               terminate_event=Mock(),
+                                               oneshot=False, options=self.options)
+        destination_thread.prepare()
+        manager.prepare.assert_called_with(config)
+        # Failure to connect in advance must not stop the thread
+        manager.prepare.side_effect = ManagerThrottleError()
+        destination_thread.prepare()
+
     # A closure to allow us to have a function that "modifies" the given
     # report in a predictable way.
     # In this case I want to set the state of the report to STATE_FINISHED
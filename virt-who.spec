@@ -96,6 +96,7 @@ rm -rf $RPM_BUILD_ROOT
 
 mkdir -p %{buildroot}/%{_sharedstatedir}/%{name}/
 touch %{buildroot}/%{_sharedstatedir}/%{name}/key
+touch %{buildroot}/%{_sharedstatedir}/%{name}/consumer_uuid
 
 mkdir -p %{buildroot}/%{_datadir}/zsh/site-functions
 install -m 644 virt-who-zsh %{buildroot}/%{_datadir}/zsh/site-functions/_virt-who
@@ -149,6 +150,7 @@ fi
 %{_mandir}/man5/virt-who-config.5.gz
 %attr(700, root, root) %{_sharedstatedir}/%{name}
 %ghost %{_sharedstatedir}/%{name}/key
+%ghost %{_sharedstatedir}/%{name}/consumer_uuid
 %{_datadir}/zsh/site-functions/_virt-who
 %{_sysconfdir}/virt-who.d/template.conf
 %attr(600, root, root) %config(noreplace) %{_sysconfdir}/virt-who.conf
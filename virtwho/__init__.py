@@ -4,6 +4,7 @@ from __future__ import print_function
 DefaultInterval = 3600  # One per hour
 MinimumSendInterval = 60  # One minute
 MinimumJobPollInterval = 15
+MaximumJobPollInterval = 300  # Five minutes
 
 SAT5 = "satellite"
 SAT6 = "sam"
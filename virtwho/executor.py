@@ -51,7 +51,7 @@ class Executor(object):
         self.dest_to_source_mapper = DestinationToSourceMapper(options)
 
         for name, config in self.dest_to_source_mapper.configs:
-            logger.info("Using config named '%s'" % name)
+            logger.info("Using config named '%s'", name)
 
     def _create_virt_backends(self):
         """
@@ -174,7 +174,7 @@ class Executor(object):
                     to_print[config.name] = report
                 except KeyError:
                     self.logger.info('Unable to retrieve report for source '
-                                     '\"%s\" for printing' % source)
+                                     '\"%s\" for printing', source)
             return to_print
 
         for thread in self.destinations:
@@ -235,3 +235,5 @@ class Executor(object):
         self.stop_threads()
         self.terminate_event.clear()
         self.datastore = Datastore()
+        # Managers are created again, configuration of the connections may have changed
+        Manager.clear_cache()
@@ -51,6 +51,13 @@ class Manager(object):
     def __repr__(self):
         return '{0.__class__.__name__}({0.logger!r}, {0.options!r})'.format(self)
 
+    def prepare(self, config=None):
+        """
+        Do initialization that can be done before the first report is
+        sent, like connecting to the server. Does nothing by default.
+        """
+        pass
+
     def sendVirtGuests(self, report, options=None):
         raise NotImplementedError()
 
@@ -64,6 +71,16 @@ class Manager(object):
         """
         raise NotImplementedError()
 
+    @classmethod
+    def clear_cache(cls):
+        """
+        Drop state shared by instances of the manager, like cached
+        connections. Called before the managers are created again
+        on reload.
+        """
+        for subcls in cls.__subclasses__():
+            subcls.clear_cache()
+
     @classmethod
     def from_config(cls, logger, config):
         """
@@ -22,10 +22,9 @@ Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
 
 from six.moves import xmlrpc_client
 from six.moves import cPickle as pickle
-import json
 
 from virtwho.manager import Manager, ManagerError
-from virtwho.util import RequestsXmlrpcTransport
+from virtwho.util import RequestsXmlrpcTransport, LazyJson
 from virtwho.virt import Guest, AbstractVirtReport
 
 
@@ -219,7 +218,7 @@ class Satellite(Manager):
         guest_count = sum(len(hypervisor.guestIds) for hypervisor in mapping['hypervisors'])
         self.logger.info("Sending update in hosts-to-guests mapping: %d hypervisors and %d guests found", hypervisor_count, guest_count)
         serialized_mapping = {'hypervisors': [h.toDict() for h in mapping['hypervisors']]}
-        self.logger.debug("Host-to-guest mapping: %s", json.dumps(serialized_mapping, indent=4))
+        self.logger.debug("Host-to-guest mapping: %s", LazyJson(serialized_mapping, indent=4))
         if len(mapping) == 0:
             self.logger.info("no hypervisors found, not sending data to satellite")
 
@@ -22,6 +22,13 @@ Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
 
 import os
 import json
+import socket
+import ssl
+import threading
+import time
+from contextlib import contextmanager
+from collections import namedtuple
+from operator import itemgetter
 from six.moves.http_client import BadStatusLine
 
 import rhsm.connection as rhsm_connection
@@ -30,6 +37,7 @@ import rhsm.config as rhsm_config
 
 from virtwho.config import NotSetSentinel
 from virtwho.manager import Manager, ManagerError, ManagerFatalError, ManagerThrottleError
+from virtwho.util import LazyJson
 from virtwho.virt import AbstractVirtReport
 
 
@@ -52,6 +60,26 @@ STATE_MAPPING = {
 }
 
 
+# Values from [server] section of rhsm.conf, named as UEPConnection arguments
+_ServerConfig = namedtuple('_ServerConfig', [
+    'host', 'ssl_port', 'handler', 'proxy_hostname', 'proxy_port',
+    'proxy_user', 'proxy_password', 'insecure'])
+
+
+class _CachedConnection(object):
+    """
+    Connection shared by destinations with the same server and credentials,
+    together with the lock that serializes its use.
+    """
+    def __init__(self):
+        self.connection = None
+        self.lock = threading.RLock()
+
+
+# Number of seconds the check whether the certificate is readable is valid
+CERT_CHECK_INTERVAL = 30
+
+
 class NamedOptions(object):
     """
     Object used for compatibility with RHSM
@@ -61,6 +89,16 @@ class NamedOptions(object):
 
 class SubscriptionManager(Manager):
     sm_type = "sam"
+    CONSUMER_UUID_FILE = "/var/lib/virt-who/consumer_uuid"
+
+    # Connections are shared by all instances (one per destination), so
+    # destinations with the same server and credentials use one connection.
+    # Cache of connections: tuple of connection kwargs -> _CachedConnection
+    _conn_cache = {}
+    # Whether server of the cached connection has 'hypervisors_async' capability
+    _async_cache = {}
+    # Protects adding new entries to _conn_cache
+    _cache_lock = threading.Lock()
 
     """ Class for interacting subscription-manager. """
     def __init__(self, logger, options):
@@ -71,7 +109,13 @@ class SubscriptionManager(Manager):
         self.cert_file = None
         self.key_file = None
         self.readConfig()
+        # Use UUID saved by previous run, so the certificate doesn't
+        # have to be parsed when sending the first report
+        self.cert_uuid = self._load_uuid(self._cert_stat())
         self.connection = None
+        self._conn_key = None
+        self._cert_readable = None
+        self._cert_check_time = 0
 
     def readConfig(self):
         """ Parse rhsm.conf in order to obtain consumer
@@ -83,6 +127,16 @@ class SubscriptionManager(Manager):
         key = 'key.pem'
         self.cert_file = os.path.join(consumer_cert_dir, cert)
         self.key_file = os.path.join(consumer_cert_dir, key)
+        # Server values don't change while running, read them only once
+        self._server_config = _ServerConfig(
+            host=self.rhsm_config.get('server', 'hostname'),
+            ssl_port=int(self.rhsm_config.get('server', 'port')),
+            handler=self.rhsm_config.get('server', 'prefix'),
+            proxy_hostname=self.rhsm_config.get('server', 'proxy_hostname'),
+            proxy_port=self.rhsm_config.get('server', 'proxy_port'),
+            proxy_user=self.rhsm_config.get('server', 'proxy_user'),
+            proxy_password=self.rhsm_config.get('server', 'proxy_password'),
+            insecure=self.rhsm_config.get('server', 'insecure'))
 
     def _check_owner_lib(self, kwargs, config):
         """
@@ -106,7 +160,7 @@ class SubscriptionManager(Manager):
             return
 
         uuid = self.uuid()
-        consumer = self.connection.getConsumer(uuid)
+        consumer = self._request('getConsumer', uuid)
 
         if 'environment' in consumer:
             environment = consumer['environment']
@@ -115,7 +169,7 @@ class SubscriptionManager(Manager):
 
         if environment:
             environment_name = environment['name']
-            owner = self.connection.getOwner(uuid)
+            owner = self._request('getOwner', uuid)
             owner_id = owner['key']
 
             if config['owner'] != owner_id:
@@ -132,17 +186,17 @@ class SubscriptionManager(Manager):
 
     def _connect(self, config=None):
         """ Connect to the subscription-manager. """
+        with self._connection(config) as connection:
+            return connection
 
-        kwargs = {
-            'host': self.rhsm_config.get('server', 'hostname'),
-            'ssl_port': int(self.rhsm_config.get('server', 'port')),
-            'handler': self.rhsm_config.get('server', 'prefix'),
-            'proxy_hostname': self.rhsm_config.get('server', 'proxy_hostname'),
-            'proxy_port': self.rhsm_config.get('server', 'proxy_port'),
-            'proxy_user': self.rhsm_config.get('server', 'proxy_user'),
-            'proxy_password': self.rhsm_config.get('server', 'proxy_password'),
-            'insecure': self.rhsm_config.get('server', 'insecure')
-        }
+    @contextmanager
+    def _connection(self, config=None):
+        """
+        Connect to the subscription-manager and hold the lock of the
+        connection until the block ends, so destinations sharing the
+        connection don't use it at the same time.
+        """
+        kwargs = dict(self._server_config._asdict())
         kwargs_to_config = {
             'host': 'rhsm_hostname',
             'ssl_port': 'rhsm_port',
@@ -187,26 +241,85 @@ class SubscriptionManager(Manager):
             kwargs['password'] = rhsm_password
         else:
             self.logger.debug("Authenticating with certificate: %s", self.cert_file)
-            if not os.access(self.cert_file, os.R_OK):
+            if not self._is_cert_readable():
                 raise SubscriptionManagerUnregisteredError(
                     "Unable to read certificate, system is not registered or you are not root")
             kwargs['cert_file'] = self.cert_file
             kwargs['key_file'] = self.key_file
 
-        self.connection = rhsm_connection.UEPConnection(**kwargs)
+        # Reuse the connection when nothing that affects it has changed.
+        # The server is pinged only when a new connection is created, the
+        # following requests show whether it still works; the connection
+        # is dropped from the cache when they fail.
+        conn_key = tuple(sorted(kwargs.items()))
+        with self._cache_lock:
+            try:
+                cached = self._conn_cache[conn_key]
+            except KeyError:
+                cached = self._conn_cache[conn_key] = _CachedConnection()
+        # Only destinations sharing the connection wait for each other
+        with cached.lock:
+            self._conn_key = conn_key
+            self.connection = cached.connection
+            if self.connection is None:
+                self.connection = rhsm_connection.UEPConnection(**kwargs)
+                if not self._request('ping')['result']:
+                    raise SubscriptionManagerError(
+                        "Unable to obtain status from server, UEPConnection is likely not usable."
+                    )
+                cached.connection = self.connection
+
+            self._check_owner_lib(kwargs, config)
+
+            yield self.connection
+
+    def prepare(self, config=None):
+        """
+        Open the connection in advance, so it is ready (and cached)
+        when the first report is sent.
+        """
+        with self._connection(config):
+            pass
+
+    def _invalidate_connection(self):
+        """ Drop the current connection from the cache, next _connect will create new one. """
+        if self._conn_key is not None:
+            # Keep the entry, other destinations may be waiting for its lock
+            cached = self._conn_cache.get(self._conn_key)
+            if cached is not None:
+                cached.connection = None
+            self._async_cache.pop(self._conn_key, None)
+            self._conn_key = None
+
+    def _request(self, method, *args, **kwargs):
+        """
+        Call given method of the connection and turn the errors it raises
+        into ManagerError. The connection is dropped from the cache only
+        when it failed, not when the server answered with an error code.
+        """
         try:
-            if not self.connection.ping()['result']:
-                raise SubscriptionManagerError(
-                    "Unable to obtain status from server, UEPConnection is likely not usable."
-                )
-        except rhsm_connection.RateLimitExceededException as e:
-            raise ManagerThrottleError(e.retry_after)
+            return getattr(self.connection, method)(*args, **kwargs)
         except BadStatusLine:
+            self._invalidate_connection()
             raise ManagerError("Communication with subscription manager interrupted")
+        except rhsm_connection.RateLimitExceededException as e:
+            raise ManagerThrottleError(e.retry_after)
+        except rhsm_connection.GoneException:
+            raise ManagerError("Communication with subscription manager failed: consumer no longer exists")
+        except rhsm_connection.ConnectionException as e:
+            if hasattr(e, 'code'):
+                raise ManagerError("Communication with subscription manager failed with code %d: %s" % (e.code, str(e)))
+            self._invalidate_connection()
+            raise ManagerError("Communication with subscription manager failed: %s" % str(e))
+        except (socket.error, ssl.SSLError) as e:
+            self._invalidate_connection()
+            raise ManagerError("Communication with subscription manager failed: %s" % str(e))
 
-        self._check_owner_lib(kwargs, config)
-
-        return self.connection
+    @classmethod
+    def clear_cache(cls):
+        with cls._cache_lock:
+            cls._conn_cache.clear()
+            cls._async_cache.clear()
 
     def sendVirtGuests(self, report, options=None):
         """
@@ -215,69 +328,49 @@ class SubscriptionManager(Manager):
         `guests` is a list of `Guest` instances (or it children).
         """
         guests = report.guests
-        self._connect()
-
-        # Sort the list
-        guests.sort(key=lambda item: item.uuid)
-
-        serialized_guests = [guest.toDict() for guest in guests]
+        serialized_guests = sorted((guest.toDict() for guest in guests), key=itemgetter('guestId'))
         self.logger.info('Sending update in guests lists for config '
                          '"%s": %d guests found',
                          report.config.name, len(guests))
-        self.logger.debug("Domain info: %s", json.dumps(serialized_guests, indent=4))
+        self.logger.debug("Domain info: %s", LazyJson(serialized_guests, indent=4))
 
         # Send list of guest uuids to the server
-        try:
-            self.connection.updateConsumer(self.uuid(), guest_uuids=serialized_guests, hypervisor_id=report.hypervisor_id)
-        except rhsm_connection.GoneException:
-            raise ManagerError("Communication with subscription manager failed: consumer no longer exists")
-        except rhsm_connection.RateLimitExceededException as e:
-            raise ManagerThrottleError(e.retry_after)
+        with self._connection():
+            self._request('updateConsumer', self.uuid(), guest_uuids=serialized_guests,
+                          hypervisor_id=report.hypervisor_id)
         report.state = AbstractVirtReport.STATE_FINISHED
 
     def hypervisorCheckIn(self, report, options=None):
         """ Send hosts to guests mapping to subscription manager. """
-        connection = self._connect(report.config)
-
-        is_async = self._is_rhsm_server_async(report, connection)
-        serialized_mapping = self._hypervisor_mapping(report, is_async, connection)
-        self.logger.debug("Host-to-guest mapping being sent to '{owner}': {mapping}".format(
-                          owner=report.config['owner'],
-                          mapping=json.dumps(serialized_mapping, indent=4)))
-
-        # All subclasses of ConfigSection use dictionary like notation,
-        # but RHSM uses attribute like notation
-        if options:
-            named_options = NamedOptions()
-            for key, value in options['global'].items():
-                setattr(named_options, key, value)
-        else:
-            named_options = None
+        with self._connection(report.config) as connection:
+            is_async = self._is_rhsm_server_async(report, connection)
+            serialized_mapping = self._hypervisor_mapping(report, is_async, connection)
+            self.logger.debug("Host-to-guest mapping being sent to '%s': %s",
+                              report.config['owner'], LazyJson(serialized_mapping, indent=4))
+
+            # All subclasses of ConfigSection use dictionary like notation,
+            # but RHSM uses attribute like notation
+            if options:
+                named_options = NamedOptions()
+                for key, value in options['global'].items():
+                    setattr(named_options, key, value)
+            else:
+                named_options = None
 
-        try:
             try:
-                result = self.connection.hypervisorCheckIn(
+                result = self._request(
+                    'hypervisorCheckIn',
                     report.config['owner'],
                     report.config['env'],
                     serialized_mapping,
-                    options=named_options)  # pylint:disable=unexpected-keyword-arg
+                    options=named_options)
             except TypeError:
                 # This is temporary workaround until the options parameter gets implemented
                 # in python-rhsm
                 self.logger.debug(
                     "hypervisorCheckIn method in python-rhsm doesn't understand options parameter, ignoring"
                 )
-                result = self.connection.hypervisorCheckIn(report.config['owner'], report.config['env'], serialized_mapping)
-        except BadStatusLine:
-            raise ManagerError("Communication with subscription manager interrupted")
-        except rhsm_connection.RateLimitExceededException as e:
-            raise ManagerThrottleError(e.retry_after)
-        except rhsm_connection.GoneException:
-            raise ManagerError("Communication with subscription manager failed: consumer no longer exists")
-        except rhsm_connection.ConnectionException as e:
-            if hasattr(e, 'code'):
-                raise ManagerError("Communication with subscription manager failed with code %d: %s" % (e.code, str(e)))
-            raise ManagerError("Communication with subscription manager failed: %s" % str(e))
+                result = self._request('hypervisorCheckIn', report.config['owner'], report.config['env'], serialized_mapping)
 
         if is_async is True:
             report.state = AbstractVirtReport.STATE_CREATED
@@ -293,8 +386,13 @@ class SubscriptionManager(Manager):
         if connection is None:
             self._connect(report.config)
 
-        self.logger.debug("Checking if server has capability 'hypervisor_async'")
-        is_async = hasattr(self.connection, 'has_capability') and self.connection.has_capability('hypervisors_async')
+        # Capabilities of the server don't change, ask only once per connection
+        try:
+            is_async = self._async_cache[self._conn_key]
+        except KeyError:
+            self.logger.debug("Checking if server has capability 'hypervisor_async'")
+            is_async = hasattr(self.connection, 'has_capability') and self._request('has_capability', 'hypervisors_async')
+            self._async_cache[self._conn_key] = is_async
 
         if is_async:
             self.logger.debug("Server has capability 'hypervisors_async'")
@@ -310,48 +408,37 @@ class SubscriptionManager(Manager):
         if connection is None:
             self._connect(report.config)
 
-        mapping = report.association
-        serialized_mapping = {}
-        ids_seen = []
+        hypervisors = self._iter_hypervisors(report.association['hypervisors'])
 
         if is_async:
-            hosts = []
             # Transform the mapping into the async version
-            for hypervisor in mapping['hypervisors']:
-                if hypervisor.hypervisorId in ids_seen:
-                    self.logger.warning("The hypervisor id '%s' is assigned to 2 different systems. "
-                        "Only one will be recorded at the server." % hypervisor.hypervisorId)
-                hosts.append(hypervisor.toDict())
-                ids_seen.append(hypervisor.hypervisorId)
-            serialized_mapping = {'hypervisors': hosts}
+            serialized_mapping = {'hypervisors': [hypervisor.toDict() for hypervisor in hypervisors]}
         else:
             # Reformat the data from the mapping to make it fit with
             # the old api.
-            for hypervisor in mapping['hypervisors']:
-                if hypervisor.hypervisorId in ids_seen:
-                    self.logger.warning("The hypervisor id '%s' is assigned to 2 different systems. "
-                        "Only one will be recorded at the server." % hypervisor.hypervisorId)
-                guests = [g.toDict() for g in hypervisor.guestIds]
-                serialized_mapping[hypervisor.hypervisorId] = guests
-                ids_seen.append(hypervisor.hypervisorId)
+            serialized_mapping = dict((hypervisor.hypervisorId, [g.toDict() for g in hypervisor.guestIds])
+                                      for hypervisor in hypervisors)
 
         return serialized_mapping
 
+    def _iter_hypervisors(self, hypervisors):
+        """
+        Iterate over hypervisors and warn about those that share hypervisor id
+        """
+        ids_seen = set()
+        for hypervisor in hypervisors:
+            if hypervisor.hypervisorId in ids_seen:
+                self.logger.warning("The hypervisor id '%s' is assigned to 2 different systems. "
+                    "Only one will be recorded at the server.", hypervisor.hypervisorId)
+            ids_seen.add(hypervisor.hypervisorId)
+            yield hypervisor
+
     def check_report_state(self, report):
         # BZ 1554228
         job_id = str(report.job_id)
-        self._connect(report.config)
-        self.logger.debug('Checking status of job %s', job_id)
-        try:
-            result = self.connection.getJob(job_id)
-        except BadStatusLine:
-            raise ManagerError("Communication with subscription manager interrupted")
-        except rhsm_connection.RateLimitExceededException as e:
-            raise ManagerThrottleError(e.retry_after)
-        except rhsm_connection.ConnectionException as e:
-            if hasattr(e, 'code'):
-                raise ManagerError("Communication with subscription manager failed with code %d: %s" % (e.code, str(e)))
-            raise ManagerError("Communication with subscription manager failed: %s" % str(e))
+        with self._connection(report.config):
+            self.logger.debug('Checking status of job %s', job_id)
+            result = self._request('getJob', job_id)
         state = STATE_MAPPING.get(result['state'], AbstractVirtReport.STATE_FAILED)
         report.state = state
         if state not in (AbstractVirtReport.STATE_FINISHED,
@@ -365,16 +452,72 @@ class SubscriptionManager(Manager):
                 self.logger.warning("Job status report without resultData: %s", result)
                 return
             for fail in result_data.get('failedUpdate', []):
-                self.logger.error("Error during update list of guests: %s", str(fail))
+                self.logger.error("Error during update list of guests: %s", fail)
             self.logger.debug("Number of mappings unchanged: %d", len(result_data.get('unchanged', [])))
             self.logger.info("Mapping for config \"%s\" updated", report.config.name)
 
     def uuid(self):
         """ Read consumer certificate and get consumer UUID from it. """
         if not self.cert_uuid:
+            # Cached UUID was already looked up in __init__
+            cert_stat = self._cert_stat()
             try:
                 certificate = rhsm_certificate.create_from_file(self.cert_file)
                 self.cert_uuid = certificate.subject["CN"]
             except Exception as e:
                 raise SubscriptionManagerError("Unable to open certificate %s (%s):" % (self.cert_file, str(e)))
+            self._save_uuid(cert_stat)
         return self.cert_uuid
+
+    def _is_cert_readable(self):
+        """ Check if the consumer certificate is readable, reuse recent result. """
+        now = time.time()
+        if self._cert_readable is None or now - self._cert_check_time > CERT_CHECK_INTERVAL:
+            self._cert_readable = os.access(self.cert_file, os.R_OK)
+            self._cert_check_time = now
+        return self._cert_readable
+
+    def _cert_stat(self):
+        """
+        Return values identifying the current certificate file. The size
+        and inode change when the certificate is replaced within the
+        resolution of mtime.
+        """
+        try:
+            stat = os.stat(self.cert_file)
+        except OSError:
+            return None
+        return [stat.st_mtime, stat.st_size, stat.st_ino]
+
+    def _load_uuid(self, cert_stat):
+        """
+        Return consumer UUID saved by previous run of virt-who or None
+        when the certificate has changed since then.
+        """
+        if cert_stat is None:
+            return None
+        try:
+            with open(self.CONSUMER_UUID_FILE, "r") as f:
+                cached = json.load(f)
+        except (OSError, IOError, ValueError):
+            return None
+        if not isinstance(cached, dict):
+            return None
+        if cached.get('cert_file') != self.cert_file or cached.get('cert_stat') != cert_stat:
+            return None
+        self.logger.debug("Using consumer UUID cached in %s", self.CONSUMER_UUID_FILE)
+        return cached.get('uuid')
+
+    def _save_uuid(self, cert_stat):
+        """ Save consumer UUID together with values identifying the certificate. """
+        if cert_stat is None:
+            return
+        try:
+            with open(self.CONSUMER_UUID_FILE, "w") as f:
+                json.dump({
+                    'cert_file': self.cert_file,
+                    'cert_stat': cert_stat,
+                    'uuid': self.cert_uuid,
+                }, f)
+        except (OSError, IOError, TypeError) as e:
+            self.logger.debug("Unable to save consumer UUID to %s: %s", self.CONSUMER_UUID_FILE, str(e))
@@ -551,7 +551,7 @@ def parse_options():
     "in the next release. Please see 'man virt-who-config' for details on adding a configuration "\
     "section."
     if used_deprecated_cli_options:
-        logger.warning(deprecated_options_msg % ', '.join('--' + item for item in used_deprecated_cli_options))
+        logger.warning(deprecated_options_msg, ', '.join('--' + item for item in used_deprecated_cli_options))
 
     # Log pending errors
     for err in errors:
@@ -1,4 +1,5 @@
 from __future__ import print_function
+import json
 import socket
 import six
 from six.moves import xmlrpc_client
@@ -23,7 +24,8 @@ else:
     from string import ascii_letters as letters
 
 
-__all__ = ('OrderedDict', 'decode', 'generateReporterId', 'clean_filename', 'RequestsXmlrpcTransport')
+__all__ = ('OrderedDict', 'decode', 'generateReporterId', 'clean_filename', 'RequestsXmlrpcTransport',
+           'LazyJson')
 
 
 class Singleton(ABCMeta):
@@ -396,3 +398,16 @@ class DictItemsIter(object):
 
     def next(self):
         return self.__next__()
+
+
+class LazyJson(object):
+    """
+    Wrapper for logging arguments that serializes the object to JSON only
+    when the log record is actually formatted.
+    """
+    def __init__(self, obj, **kwargs):
+        self.obj = obj
+        self.kwargs = kwargs
+
+    def __str__(self):
+        return json.dumps(self.obj, **self.kwargs)
@@ -371,7 +371,7 @@ class Libvirtd(Virt):
                 domain = self._lookupDomain(self.virt.lookupByID, domainID)
                 if domain is None:
                     # Domain not found, most likely it was just destroyed, ignoring
-                    self.logger.debug("Lookup for domain by ID %s failed, probably it was just destroyed, ignoring" % domainID)
+                    self.logger.debug("Lookup for domain by ID %s failed, probably it was just destroyed, ignoring", domainID)
                     continue
 
                 if domain.UUIDString() == "00000000-0000-0000-0000-000000000000":
@@ -384,7 +384,7 @@ class Libvirtd(Virt):
                 domain = self._lookupDomain(self.virt.lookupByName, domainName)
                 if domain is None:
                     # Domain not found, most likely it was just destroyed, ignoring
-                    self.logger.debug("Lookup for domain by name '%s' failed, probably it was just destroyed, ignoring" % domainName)
+                    self.logger.debug("Lookup for domain by name '%s' failed, probably it was just destroyed, ignoring", domainName)
                     continue
 
                 domains.append(LibvirtdGuest(domain))
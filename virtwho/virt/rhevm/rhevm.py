@@ -159,7 +159,7 @@ class RhevM(virt.Virt):
         try:
             api = ElementTree.fromstring(response.content)
         except Exception as e:
-            self.logger.debug("Invalid xml file: %s" % response)
+            self.logger.debug("Invalid xml file: %s", response)
             raise virt.VirtError("Invalid XML file returned from RHEV-M: %s" % str(e))
         version = api.find('.//version')
         if version is not None:
@@ -197,7 +197,7 @@ class RhevM(virt.Virt):
         try:
             return ElementTree.fromstring(response)
         except Exception as e:
-            self.logger.debug("Invalid xml file: %s" % response)
+            self.logger.debug("Invalid xml file: %s", response)
             raise virt.VirtError("Invalid XML file returned from RHEV-M: %s" % str(e))
 
     def getHostGuestMapping(self):
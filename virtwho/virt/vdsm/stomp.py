@@ -186,7 +186,7 @@ class StompClient(object):
                 self._validate_connected(self._recv_frame())
                 return  # success connecting
             except (socket.error, IOError) as e:
-                log.warning('Unable to connect %s:%s: %s' % (self.host, self.port, text_type(e)))
+                log.warning('Unable to connect %s:%s: %s', self.host, self.port, text_type(e))
         raise IOError('Unable to connect to %s:%s' % (self.host, self.port))
 
     @staticmethod
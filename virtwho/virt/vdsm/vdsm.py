@@ -180,7 +180,7 @@ class Vdsm(Virt):
                 description = 'JSON-RPC with SSL'
             else:
                 description = 'JSON-RPC'
-            self.logger.warning('Unable to connect via %s' % description, exc_info=True)
+            self.logger.warning('Unable to connect via %s', description, exc_info=True)
         return False
 
     def _xmlrpc(self, addr, ssl_context=None):
@@ -204,7 +204,7 @@ class Vdsm(Virt):
                 description = 'XML-RPC with SSL'
             else:
                 description = 'XML-RPC'
-            self.logger.warning('Unable to connect via %s' % description, exc_info=True)
+            self.logger.warning('Unable to connect via %s', description, exc_info=True)
         return False
 
     def prepare(self):
@@ -35,7 +35,7 @@ import six
 from virtwho.config import NotSetSentinel, Satellite5DestinationInfo, \
     Satellite6DestinationInfo, DefaultDestinationInfo, VW_GLOBAL
 from virtwho.manager import ManagerError, ManagerThrottleError, ManagerFatalError
-from virtwho import MinimumSendInterval, MinimumJobPollInterval
+from virtwho import MinimumSendInterval, MinimumJobPollInterval, MaximumJobPollInterval
 
 try:
     from collections import OrderedDict
@@ -81,20 +81,28 @@ class Guest(object):
         self.uuid = uuid
         self.virtWhoType = virt_type
         self.state = state
+        self._dict = None
+        self._dict_key = None
 
     def __repr__(self):
         return 'Guest({0.uuid!r}, {0.virtWhoType!r}, {0.state!r})'.format(self)
 
     def toDict(self):
-        d = OrderedDict((
-            ('guestId', self.uuid),
-            ('state', self.state),
-            ('attributes', {
-                'virtWhoType': self.virtWhoType,
-                'active': 1 if self.state in (self.STATE_RUNNING, self.STATE_PAUSED) else 0
-            }),
-        ))
-        return d
+        # The guest is serialized for computing the report hash as well as
+        # for sending, reuse the result until the guest is changed.
+        # Callers must not modify the returned dict.
+        key = (self.uuid, self.virtWhoType, self.state)
+        if self._dict is None or self._dict_key != key:
+            self._dict = OrderedDict((
+                ('guestId', self.uuid),
+                ('state', self.state),
+                ('attributes', {
+                    'virtWhoType': self.virtWhoType,
+                    'active': 1 if self.state in (self.STATE_RUNNING, self.STATE_PAUSED) else 0
+                }),
+            ))
+            self._dict_key = key
+        return self._dict
 
 
 class Hypervisor(object):
@@ -498,6 +506,16 @@ class DestinationThread(IntervalThread):
         # value of the retry_after header.
         self.interval_modifier = 0
 
+    def prepare(self):
+        """
+        Connect to the destination while we wait for the first reports.
+        Errors are only logged, they will show up again when sending.
+        """
+        try:
+            self.dest.prepare(self.config)
+        except Exception as e:
+            self.logger.debug("Unable to connect to destination in advance: %s", str(e))
+
     def _get_data(self):
         """
         Gets the latest report from the source for each source_key
@@ -509,17 +527,21 @@ class DestinationThread(IntervalThread):
 
     def _get_data_common(self, source_keys, ignore_duplicates=True, log_missing_reports=True):
         reports = {}
+        # Batch reports are shared by several sources, check state of each only once
+        checked_reports = set()
         for source_key in source_keys:
             report = self.source.get(source_key, NotSetSentinel)
             if report is None or report is NotSetSentinel:
                 if log_missing_reports:
-                    self.logger.debug("No report available for source: %s" %
+                    self.logger.debug("No report available for source: %s",
                                       source_key)
                 continue
             if source_key in self.submitted_report_and_hash_for_source:
                 submitted_report = self.submitted_report_and_hash_for_source[source_key][0]
                 submitted_hash = self.submitted_report_and_hash_for_source[source_key][1]
-                self.check_report_status(submitted_report)
+                if submitted_report not in checked_reports:
+                    self.check_report_status(submitted_report)
+                    checked_reports.add(submitted_report)
                 self.submitted_report_and_hash_for_source.pop(source_key)
                 if submitted_report.state == AbstractVirtReport.STATE_FINISHED:
                     self.last_report_for_source[source_key] = submitted_hash
@@ -623,7 +645,7 @@ class DestinationThread(IntervalThread):
                 # if it was recoverable we'll get something else next time.
                 # if it was not recoverable we'll see this again from this
                 # source. Thus we'll just log this at the debug level.
-                self.logger.debug('ErrorReport received for source: %s' % source_key)
+                self.logger.debug('ErrorReport received for source: %s', source_key)
                 if self._oneshot:
                     # Consider this source dealt with if we are in oneshot mode
                     sources_erred.append(source_key)
@@ -640,11 +662,9 @@ class DestinationThread(IntervalThread):
             num_429_received = 0
             while result is None and not self.is_terminated():
                 try:
-                    self.logger.info('Sending updated Host-to-guest mapping to "{owner}" including '
-                                     '{num_hypervisors} hypervisors and {num_guests} '
-                                     'guests'.format(owner=self.config['owner'],
-                                                     num_hypervisors=total_hypervisors,
-                                                     num_guests=total_guests))
+                    self.logger.info('Sending updated Host-to-guest mapping to "%s" including '
+                                     '%d hypervisors and %d guests', self.config['owner'],
+                                     total_hypervisors, total_guests)
                     result = self.dest.hypervisorCheckIn(
                             batch_host_guest_report,
                             options=self.options)
@@ -664,7 +684,7 @@ class DestinationThread(IntervalThread):
                     self.interval_modifier = retry_after
                 except (ManagerError, ManagerFatalError) as err:
                     self.logger.exception("Error during hypervisor "
-                                          "checkin: %s" % err)
+                                          "checkin: %s", err)
                     if self._oneshot:
                         sources_erred.extend(reports_batched)
                     break
@@ -735,18 +755,19 @@ class DestinationThread(IntervalThread):
         Checks at the server for the state of the previously submitted job. The state is recorded
         in the passed-in report
         """
-        self.logger.debug("Existing report state: %s" % report.state)
+        self.logger.debug("Existing report state: %s", report.state)
         num_429_received = 0
         first_attempt = True
+        attempts = 0
         while not report.state or report.state == AbstractVirtReport.STATE_CREATED\
             or report.state == AbstractVirtReport.STATE_PROCESSING and first_attempt:
             if self.interval_modifier != 0:
                 wait_time = self.interval_modifier
                 self.interval_modifier = 0
-            elif not first_attempt:
-                wait_time = MinimumJobPollInterval * 2
             else:
-                wait_time = MinimumJobPollInterval
+                # Back off exponentially, jobs that are not done quickly tend to take long
+                wait_time = min(MinimumJobPollInterval * 2 ** attempts, MaximumJobPollInterval)
+            attempts += 1
 
             self.wait(wait_time=wait_time)
 
@@ -838,7 +859,7 @@ class Satellite5DestinationThread(DestinationThread):
                 # if it was recoverable we'll get something else next time.
                 # if it was not recoverable we'll see this again from this
                 # source. Thus we'll just log this at the debug level.
-                self.logger.debug('ErrorReport received for source: %s' % source_key)
+                self.logger.debug('ErrorReport received for source: %s', source_key)
                 if self._oneshot:
                     # Consider this source dealt with if we are in oneshot mode
                     sources_sent.append(source_key)
@@ -99,7 +99,7 @@ class Xen(virt.Virt):
 
     def _prepare(self):
         """ Prepare for obtaining information from Xen server. """
-        self.logger.debug("Logging into XEN pools %s" % self.url)
+        self.logger.debug("Logging into XEN pools %s", self.url)
         self.login()
 
     def login(self, url=None):
@@ -109,7 +109,7 @@ class Xen(virt.Virt):
             # Don't log message containing password
             self.session = XenAPI.Session(url, transport=RequestsXmlrpcTransport(url))
             self.session.xenapi.login_with_password(self.username, self.password)
-            self.logger.debug("XEN pool login successful with user %s" % self.username)
+            self.logger.debug("XEN pool login successful with user %s", self.username)
         except NewMaster as nm:
             url = nm.new_master()
             if "://" not in url:
@@ -119,7 +119,7 @@ class Xen(virt.Virt):
         except requests.ConnectionError as e:
             raise virt.VirtError(str(e))
         except Exception as e:
-            self.logger.exception("Unable to login to XENserver %s" % self.url)
+            self.logger.exception("Unable to login to XENserver %s", self.url)
             raise virt.VirtError(str(e))
 
     def getHostGuestMapping(self):